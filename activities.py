@@ -1,8 +1,23 @@
 import random
-import uuid
+import os
 import asyncio
+import logging
+from typing import List, Tuple
 from temporalio import activity
 
+logger = logging.getLogger(__name__)
+_rand = random.random
+
+# Simulated external API latency in seconds (0 disables it)
+_SIM_DELAY = float(os.environ.get("DEMO_SIM_DELAY", "0"))
+
+# Resource ID prefixes
+_CHARGE_PREFIX = "CH-"
+_REFUND_PREFIX = "RF-"
+_RESERVATION_PREFIX = "RES-"
+_FULFILLMENT_PREFIX = "FULL-"
+_PICKUP_PREFIX = "PICKUP-"
+
 
 # =============================================================================
 # PAYMENT ACTIVITIES
@@ -11,23 +26,25 @@ from temporalio import activity
 @activity.defn
 async def charge_payment(payment_method_id: str, amount: float, order_id: str) -> dict:
     """Charge payment - 10% failure rate for demo"""
-    await asyncio.sleep(0.5)  # Simulate API call
+    if _SIM_DELAY:
+        await asyncio.sleep(_SIM_DELAY)
 
-    if random.random() < 0.1:
+    if _rand() < 0.1:
         raise Exception("Payment declined - insufficient funds")
 
-    charge_id = f"CH-{uuid.uuid4().hex[:8]}"
-    activity.logger.info(f"💳 Charged ${amount} for order {order_id} → {charge_id}")
+    charge_id = _CHARGE_PREFIX + os.urandom(4).hex()
+    activity.logger.info("💳 Charged $%s for order %s → %s", amount, order_id, charge_id)
     return {"charge_id": charge_id}
 
 
 @activity.defn
 async def refund_payment(charge_id: str) -> dict:
     """Refund payment - always succeeds (critical compensation)"""
-    await asyncio.sleep(0.5)
+    if _SIM_DELAY:
+        await asyncio.sleep(_SIM_DELAY)
 
-    refund_id = f"RF-{uuid.uuid4().hex[:8]}"
-    activity.logger.info(f"💰 Refunded payment {charge_id} → {refund_id}")
+    refund_id = _REFUND_PREFIX + os.urandom(4).hex()
+    activity.logger.info("💰 Refunded payment %s → %s", charge_id, refund_id)
     return {"refund_id": refund_id}
 
 
@@ -38,19 +55,21 @@ async def refund_payment(charge_id: str) -> dict:
 @activity.defn
 async def reserve_inventory(order_id: str, product_name: str) -> dict:
     """Reserve inventory"""
-    await asyncio.sleep(0.3)
+    if _SIM_DELAY:
+        await asyncio.sleep(_SIM_DELAY)
 
-    reservation_id = f"RES-{uuid.uuid4().hex[:8]}"
-    activity.logger.info(f"📦 Reserved inventory for {product_name} → {reservation_id}")
+    reservation_id = _RESERVATION_PREFIX + os.urandom(4).hex()
+    activity.logger.info("📦 Reserved inventory for %s → %s", product_name, reservation_id)
     return {"reservation_id": reservation_id}
 
 
 @activity.defn
 async def release_inventory(reservation_id: str) -> dict:
     """Release inventory - compensation"""
-    await asyncio.sleep(0.3)
+    if _SIM_DELAY:
+        await asyncio.sleep(_SIM_DELAY)
 
-    activity.logger.info(f"📦 Released inventory reservation {reservation_id}")
+    activity.logger.info("📦 Released inventory reservation %s", reservation_id)
     return {"released": True}
 
 
@@ -61,29 +80,32 @@ async def release_inventory(reservation_id: str) -> dict:
 @activity.defn
 async def create_fulfillment(order_id: str) -> dict:
     """Create fulfillment order"""
-    await asyncio.sleep(0.5)
+    if _SIM_DELAY:
+        await asyncio.sleep(_SIM_DELAY)
 
-    fulfillment_id = f"FULL-{uuid.uuid4().hex[:8]}"
-    activity.logger.info(f"Created fulfillment order -> {fulfillment_id}")
+    fulfillment_id = _FULFILLMENT_PREFIX + os.urandom(4).hex()
+    activity.logger.info("Created fulfillment order -> %s", fulfillment_id)
     return {"fulfillment_id": fulfillment_id}
 
 
 @activity.defn
 async def cancel_fulfillment(fulfillment_id: str) -> dict:
     """Cancel fulfillment - compensation"""
-    await asyncio.sleep(0.3)
+    if _SIM_DELAY:
+        await asyncio.sleep(_SIM_DELAY)
 
-    activity.logger.info(f"🏭 Cancelled fulfillment {fulfillment_id}")
+    activity.logger.info("🏭 Cancelled fulfillment %s", fulfillment_id)
     return {"cancelled": True}
 
 
 @activity.defn
 async def request_pickup(fulfillment_id: str) -> dict:
     """Trigger delivery workflow via partner system (mock)"""
-    await asyncio.sleep(0.3)
+    if _SIM_DELAY:
+        await asyncio.sleep(_SIM_DELAY)
 
-    pickup_request_id = f"PICKUP-{uuid.uuid4().hex[:8]}"
-    activity.logger.info(f"Triggered delivery via partner system for {fulfillment_id} -> {pickup_request_id}")
+    pickup_request_id = _PICKUP_PREFIX + os.urandom(4).hex()
+    activity.logger.info("Triggered delivery via partner system for %s -> %s", fulfillment_id, pickup_request_id)
     return {"pickup_request_id": pickup_request_id}
 
 
@@ -91,9 +113,62 @@ async def request_pickup(fulfillment_id: str) -> dict:
 # NOTIFICATION ACTIVITIES
 # =============================================================================
 
+# Notifications are queued by send_notification and delivered in the background
+# by drain_notifications, so workflows don't wait on the email provider
+notification_queue: asyncio.Queue = asyncio.Queue()
+
+# Max notifications handed to the provider in one call, and how long (seconds)
+# to keep collecting after the first one arrives
+_NOTIFY_BATCH_SIZE = 20
+_NOTIFY_BATCH_WINDOW = 0.1
+
+
 @activity.defn
 async def send_notification(customer_email: str, subject: str, message: str) -> dict:
-    """Send email notification - just logs"""
-    activity.logger.info(f"📧 Email to {customer_email}: {subject}")
-    activity.logger.info(f"   → {message}")
-    return {"sent": True}
+    """Send email notification - queued for background delivery"""
+    notification_queue.put_nowait((customer_email, subject, message))
+    return {"queued": True}
+
+
+@activity.defn
+async def send_notification_batch(recipient: str, notifications: List[Tuple[str, str]]) -> dict:
+    """Send several (subject, message) emails to one recipient in a single activity"""
+    for subject, message in notifications:
+        notification_queue.put_nowait((recipient, subject, message))
+    return {"queued": len(notifications)}
+
+
+async def drain_notifications():
+    """Deliver queued notifications, batching those that arrive close together"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await notification_queue.get()]
+        deadline = loop.time() + _NOTIFY_BATCH_WINDOW
+        # Deliver what was collected even if cancelled mid-window
+        try:
+            while len(batch) < _NOTIFY_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(notification_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            _deliver_notifications(batch)
+
+
+def flush_notifications():
+    """Deliver everything still queued (used on worker shutdown)"""
+    batch = []
+    while not notification_queue.empty():
+        batch.append(notification_queue.get_nowait())
+    if batch:
+        _deliver_notifications(batch)
+
+
+def _deliver_notifications(batch: list):
+    """Send a batch of emails - just logs"""
+    for customer_email, subject, message in batch:
+        logger.info("📧 Email to %s: %s", customer_email, subject)
+        logger.info("   → %s", message)
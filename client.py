@@ -1,22 +1,55 @@
 import asyncio
-import uuid
+import time
 from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Tuple
 
-from temporalio.client import Client
-
-from models import PreOrder
-from workflow import PreOrderWorkflow
+from runtime import get_shared_client
 
 
 async def get_workflow_handle(workflow_id: str):
     """Helper to get a workflow handle"""
-    client = await Client.connect("localhost:7233")
-    return client.get_workflow_handle(workflow_id)
+    return (await get_shared_client()).get_workflow_handle(workflow_id)
+
+
+# Recent query results keyed by (workflow_id, query name); the cached value is
+# the query task itself, so concurrent identical queries share one round-trip
+_query_cache: Dict[Tuple[str, str], Tuple[float, "asyncio.Future[Any]"]] = {}
+_use_query_cache = True
 
 
-async def place_order():
-    """Place a new pre-order"""
-    client = await Client.connect("localhost:7233")
+async def _cached_query(workflow_id: str, name: str, ttl: float = 0.5):
+    """Helper to run a query, reusing a result fetched in the last `ttl` seconds"""
+    handle = await get_workflow_handle(workflow_id)
+    if not _use_query_cache:
+        return await handle.query(name)
+
+    key = (workflow_id, name)
+    now = time.monotonic()
+    cached = _query_cache.get(key)
+    if cached is None or now - cached[0] > ttl:
+        cached = (now, asyncio.ensure_future(handle.query(name)))
+        _query_cache[key] = cached
+    try:
+        return await cached[1]
+    except Exception:
+        # Don't replay a failure (e.g. workflow not found) for the rest of the TTL
+        if _query_cache.get(key) is cached:
+            del _query_cache[key]
+        raise
+
+
+async def place_order(jitter_ms: int = 0):
+    """Place a new pre-order, optionally after a random delay of up to jitter_ms"""
+    # Only this command needs the workflow and model modules, so signal and
+    # query invocations skip importing them
+    import random
+    import uuid
+
+    from models import PreOrder
+    from workflow import PreOrderWorkflow
+
+    # Start connecting before building the order so the two overlap
+    connect_task = asyncio.create_task(get_shared_client())
 
     # Release date = now (in production, this would be months in the future)
     release_date = datetime.now(timezone.utc)
@@ -27,9 +60,14 @@ async def place_order():
         product_name="Mega Bot 2077",
         amount=888.00,
         payment_method_id="pm_card_visa",
-        release_date=release_date,
+        release_date=release_date.isoformat(),
     )
 
+    # Spread out bulk starts so they don't all hit the server at once
+    if jitter_ms:
+        await asyncio.sleep(random.random() * jitter_ms / 1000)
+
+    client = await connect_task
     handle = await client.start_workflow(
         PreOrderWorkflow.run,
         order,
@@ -92,8 +130,7 @@ async def confirm_delivery(workflow_id: str):
 
 async def get_status(workflow_id: str):
     """Query: Get order status"""
-    handle = await get_workflow_handle(workflow_id)
-    status = await handle.query("get_status")
+    status = await _cached_query(workflow_id, "get_status")
     print(f"📋 Order Status:")
     print(f"   Order ID: {status['order_id']}")
     print(f"   State: {status['state']}")
@@ -101,11 +138,13 @@ async def get_status(workflow_id: str):
 
 async def get_compensation_log(workflow_id: str):
     """Query: Get compensation log (actions recorded for saga)"""
-    handle = await get_workflow_handle(workflow_id)
-    log = await handle.query("get_compensation_log")
+    from models import unpack_compensation
+
+    log = await _cached_query(workflow_id, "get_compensation_log")
     print(f"📜 Compensation Log ({len(log)} actions recorded):")
-    for i, record in enumerate(log, 1):
-        print(f"   {i}. {record['action']} → {record['resource_id']}")
+    for i, packed in enumerate(log, 1):
+        action, resource_id = unpack_compensation(packed)
+        print(f"   {i}. {action} → {resource_id}")
 
 
 async def get_deadline_info(workflow_id: str):
@@ -120,13 +159,11 @@ async def get_deadline_info(workflow_id: str):
     # Calculate remaining time on client side (using real current time)
     deadline_dt = datetime.fromisoformat(info["deadline"])
     now = datetime.now(timezone.utc)
-    remaining = (deadline_dt - now).total_seconds()
-    remaining = max(0, remaining)
+    remaining = max(0, int((deadline_dt - now).total_seconds()))
 
-    days = int(remaining // 86400)
-    hours = int((remaining % 86400) // 3600)
-    minutes = int((remaining % 3600) // 60)
-    seconds = int(remaining % 60)
+    days, remaining = divmod(remaining, 86400)
+    hours, remaining = divmod(remaining, 3600)
+    minutes, seconds = divmod(remaining, 60)
 
     print(f"⏰ Deadline Info:")
     print(f"   Deadline: {info['deadline']}")
@@ -137,6 +174,22 @@ async def get_deadline_info(workflow_id: str):
 # CLI
 # =============================================================================
 
+# Signals (and place-order) run before queries, so queries in the same
+# invocation observe the signals sent alongside them
+SIGNAL_COMMANDS = {
+    "start-fulfillment": start_fulfillment,
+    "cancel": cancel_order,
+    "item-picked": item_picked,
+    "confirm-delivery": confirm_delivery,
+}
+
+QUERY_COMMANDS = {
+    "status": get_status,
+    "deadline": get_deadline_info,
+    "compensation-log": get_compensation_log,
+}
+
+
 def print_usage():
     print("Pre-Order Demo CLI")
     print("==================")
@@ -154,68 +207,80 @@ def print_usage():
     print("  python client.py status <workflow_id>")
     print("  python client.py deadline <workflow_id>")
     print("  python client.py compensation-log <workflow_id>")
-
-
-def main():
-    import sys
-
-    if len(sys.argv) < 2:
-        print_usage()
-        return
-
-    command = sys.argv[1]
-
-    # Place order
-    if command == "place-order":
-        asyncio.run(place_order())
-
-    # Signals
-    elif command == "start-fulfillment":
-        if len(sys.argv) < 3:
+    print("")
+    print("Options:")
+    print("  --no-cache       Always query the server instead of reusing recent results")
+    print("  --jitter-ms <n>  Delay place-order by a random 0..n ms (spreads bulk starts)")
+    print("")
+    print("Commands can be combined and run concurrently over one connection:")
+    print("  python client.py item-picked <workflow_id> status <other_workflow_id>")
+
+
+def parse_commands(argv, jitter_ms: int = 0):
+    """Split argv into (signal calls, query calls), or None if invalid"""
+    signals, queries = [], []
+    i = 0
+    while i < len(argv):
+        command = argv[i]
+        i += 1
+
+        if command == "place-order":
+            signals.append((place_order, (jitter_ms,)))
+            continue
+
+        if command in SIGNAL_COMMANDS:
+            group, handler = signals, SIGNAL_COMMANDS[command]
+        elif command in QUERY_COMMANDS:
+            group, handler = queries, QUERY_COMMANDS[command]
+        else:
+            print(f"Unknown command: {command}")
+            print_usage()
+            return None
+
+        if i >= len(argv):
             print("Error: workflow_id required")
-            return
-        asyncio.run(start_fulfillment(sys.argv[2]))
+            return None
+        group.append((handler, (argv[i],)))
+        i += 1
 
-    elif command == "cancel":
-        if len(sys.argv) < 3:
-            print("Error: workflow_id required")
-            return
-        asyncio.run(cancel_order(sys.argv[2]))
+    return signals, queries
 
-    elif command == "item-picked":
-        if len(sys.argv) < 3:
-            print("Error: workflow_id required")
-            return
-        asyncio.run(item_picked(sys.argv[2]))
 
-    elif command == "confirm-delivery":
-        if len(sys.argv) < 3:
-            print("Error: workflow_id required")
-            return
-        asyncio.run(confirm_delivery(sys.argv[2]))
+async def run_commands(signals, queries):
+    """Run all signals concurrently, then all queries, over one client"""
+    await get_shared_client()
+    await asyncio.gather(*(handler(*args) for handler, args in signals))
+    await asyncio.gather(*(handler(*args) for handler, args in queries))
 
-    # Queries
-    elif command == "status":
-        if len(sys.argv) < 3:
-            print("Error: workflow_id required")
-            return
-        asyncio.run(get_status(sys.argv[2]))
 
-    elif command == "deadline":
-        if len(sys.argv) < 3:
-            print("Error: workflow_id required")
-            return
-        asyncio.run(get_deadline_info(sys.argv[2]))
-
-    elif command == "compensation-log":
-        if len(sys.argv) < 3:
-            print("Error: workflow_id required")
+def main():
+    import sys
+    global _use_query_cache
+
+    args = sys.argv[1:]
+    if "--no-cache" in args:
+        args.remove("--no-cache")
+        _use_query_cache = False
+
+    jitter_ms = 0
+    if "--jitter-ms" in args:
+        i = args.index("--jitter-ms")
+        try:
+            jitter_ms = int(args[i + 1])
+        except (IndexError, ValueError):
+            print("Error: --jitter-ms requires a number of milliseconds")
             return
-        asyncio.run(get_compensation_log(sys.argv[2]))
+        del args[i:i + 2]
 
-    else:
-        print(f"Unknown command: {command}")
+    if not args:
         print_usage()
+        return
+
+    commands = parse_commands(args, jitter_ms)
+    if commands is None:
+        return
+
+    asyncio.run(run_commands(*commands))
 
 
 if __name__ == "__main__":
@@ -1,21 +1,25 @@
 from dataclasses import dataclass
-from datetime import datetime
-from enum import Enum
-from typing import Optional
+from enum import IntEnum
+from typing import Optional, Tuple
 
 
-class OrderState(Enum):
+class OrderState(IntEnum):
     """Order state machine (simplified)"""
-    PRE_ORDER_PLACED = "pre_order_placed"
-    PAYMENT_PROCESSING = "payment_processing"
-    AWAITING_RELEASE = "awaiting_release"
-    FULFILLMENT_IN_PROGRESS = "fulfillment_in_progress"
-    AWAITING_DELIVERY = "awaiting_delivery"
-    DELIVERED = "delivered"
-    REFUNDED = "refunded"
+    PRE_ORDER_PLACED = 1
+    PAYMENT_PROCESSING = 2
+    AWAITING_RELEASE = 3
+    FULFILLMENT_IN_PROGRESS = 4
+    AWAITING_DELIVERY = 5
+    DELIVERED = 6
+    REFUNDED = 7
 
+    @property
+    def label(self) -> str:
+        """Readable state name for logs and queries"""
+        return self.name.lower()
 
-@dataclass
+
+@dataclass(slots=True, frozen=True)
 class PreOrder:
     """Pre-order information"""
     order_id: str
@@ -23,11 +27,16 @@ class PreOrder:
     product_name: str
     amount: float
     payment_method_id: str
-    release_date: datetime
+    release_date: str  # ISO-8601, UTC
+
+
+# Compensation log entries travel in query results as "action:resource_id"
+def pack_compensation(action: str, resource_id: str) -> str:
+    """Pack a compensation log entry for query results"""
+    return f"{action}:{resource_id}"
 
 
-@dataclass
-class CompensationRecord:
-    """Tracks an action for potential compensation (Saga pattern)"""
-    action: str
-    resource_id: str
\ No newline at end of file
+def unpack_compensation(packed: str) -> Tuple[str, str]:
+    """Split a packed compensation log entry back into (action, resource_id)"""
+    action, _, resource_id = packed.partition(":")
+    return action, resource_id
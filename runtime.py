@@ -0,0 +1,21 @@
+import asyncio
+from typing import Optional
+
+from temporalio.client import Client
+
+TEMPORAL_ADDRESS = "localhost:7233"
+
+# One client per process, shared by every worker and CLI helper: the SDK
+# multiplexes all RPCs over the client's single gRPC channel
+_client: Optional[Client] = None
+_client_lock = asyncio.Lock()
+
+
+async def get_shared_client() -> Client:
+    """Get the process-wide client, connecting on first use"""
+    global _client
+    if _client is None:
+        async with _client_lock:
+            if _client is None:
+                _client = await Client.connect(TEMPORAL_ADDRESS)
+    return _client
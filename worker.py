@@ -1,8 +1,8 @@
 import asyncio
 
-from temporalio.client import Client
 from temporalio.worker import Worker
 
+from runtime import get_shared_client
 from workflow import PreOrderWorkflow
 from activities import (
     charge_payment,
@@ -13,12 +13,15 @@ from activities import (
     cancel_fulfillment,
     request_pickup,
     send_notification,
+    send_notification_batch,
+    drain_notifications,
+    flush_notifications,
 )
 
 
 async def main():
     # Connect to Temporal server
-    client = await Client.connect("localhost:7233")
+    client = await get_shared_client()
 
     # Create worker
     worker = Worker(
@@ -34,14 +37,24 @@ async def main():
             cancel_fulfillment,
             request_pickup,
             send_notification,
+            send_notification_batch,
         ],
     )
 
     print("⚡ Worker started! Listening on 'preorder-queue'...")
     print("   Press Ctrl+C to stop\n")
 
+    # Deliver queued notifications in the background
+    drainer = asyncio.create_task(drain_notifications())
+
     # Run the worker
-    await worker.run()
+    try:
+        await worker.run()
+    finally:
+        # Queued notifications were already reported as done to Temporal, so
+        # deliver them before stopping rather than dropping them
+        flush_notifications()
+        drainer.cancel()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,40 @@
+import asyncio
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from temporalio import workflow
 from temporalio.common import RetryPolicy
 
 with workflow.unsafe.imports_passed_through():
-    from models import OrderState, PreOrder, CompensationRecord
+    from models import OrderState, PreOrder, pack_compensation
+
+# Activity timeouts and retry policies, shared by every run
+_DEFAULT_ACTIVITY_TIMEOUT = timedelta(seconds=30)
+_NOTIFY_TIMEOUT = timedelta(seconds=10)
+_PAYMENT_RETRY = RetryPolicy(maximum_attempts=3, initial_interval=timedelta(seconds=2))
+_INVENTORY_RETRY = RetryPolicy(maximum_attempts=3, initial_interval=timedelta(seconds=2))
+_COMPENSATION_RETRY = RetryPolicy(
+    maximum_attempts=100,
+    initial_interval=timedelta(seconds=1),
+    maximum_interval=timedelta(seconds=30),
+)
+
+# Fulfillment must start within this long after the release date
+_RELEASE_GRACE_PERIOD = timedelta(weeks=1)
+
+# Pick-up reminders fire at this interval; any that queue up behind a slow
+# send go out together in the next batch
+_REMINDER_INTERVAL = timedelta(seconds=20)
+
+# Pick-up reminder recipient and subject
+_PARTNER_EMAIL = "partner@example.com"
+_SUBJECT_PICKUP_REMINDER = "Pick Up Reminder"
+
+# Signal flag bits, combined in PreOrderWorkflow._flags
+_F_CANCEL = 1
+_F_START = 2
+_F_PICKED = 4
+_F_DELIVERED = 8
 
 
 @workflow.defn
@@ -23,17 +52,25 @@ class PreOrderWorkflow:
     def __init__(self):
         self.state = OrderState.PRE_ORDER_PLACED
         self.order: Optional[PreOrder] = None
-        self.compensation_log: List[CompensationRecord] = []
 
-        # Signal flags
-        self.cancel_requested = False
-        self.start_fulfillment_requested = False
-        self.item_picked_confirmed = False
-        self.delivery_confirmed = False
+        # Saga log as parallel lists: what was done, the resource it produced,
+        # and the activity that undoes it
+        self._comp_actions: List[str] = []
+        self._comp_resource_ids: List[str] = []
+        self._comp_activities: List[str] = []
+
+        # get_compensation_log result, keyed by log length (entries are only appended)
+        self._comp_log_cache: Optional[Tuple[int, List[str]]] = None
+
+        # Signal flags (_F_* bits)
+        self._flags = 0
 
         # Deadline tracking
         self.deadline: Optional[datetime] = None
 
+        # Notifications sent without blocking; awaited before the workflow completes
+        self._pending_notifications: List[asyncio.Task] = []
+
     # =========================================================================
     # MAIN WORKFLOW
     # =========================================================================
@@ -41,146 +78,192 @@ class PreOrderWorkflow:
     @workflow.run
     async def run(self, order: PreOrder) -> dict:
         self.order = order
-        workflow.logger.info(f"Starting pre-order workflow for {order.order_id}")
+        try:
+            return await self._run_phases(order)
+        finally:
+            # Detached notifications must be delivered before the workflow ends,
+            # without a failed notice hiding the original error
+            await asyncio.gather(*self._pending_notifications, return_exceptions=True)
 
-        # =====================================================================
-        # PHASE 1: PAYMENT PROCESSING
-        # =====================================================================
-        self._set_state(OrderState.PAYMENT_PROCESSING)
+    async def _run_phases(self, order: PreOrder) -> dict:
+        workflow.logger.info("Starting pre-order workflow for %s", order.order_id)
 
+        # PHASE 1: PAYMENT PROCESSING
         try:
-            result = await workflow.execute_activity(
-                "charge_payment",
-                args=[order.payment_method_id, order.amount, order.order_id],
-                start_to_close_timeout=timedelta(seconds=30),
-                retry_policy=RetryPolicy(maximum_attempts=3, initial_interval=timedelta(seconds=2)),
-            )
-            charge_id = result["charge_id"]
-            self._record_compensation("payment_charged", charge_id)
-
-            await self._notify(
-                "Pre-Order Confirmed!",
-                f"Payment of ${order.amount} received for {order.product_name}."
-            )
+            await self._process_payment()
         except Exception as e:
-            workflow.logger.error(f"Payment failed: {e}")
+            workflow.logger.error("Payment failed: %s", e)
             return {"status": "payment_failed", "order_id": order.order_id, "reason": str(e)}
 
-        # =====================================================================
         # PHASE 2: RESERVE INVENTORY
-        # =====================================================================
         try:
-            result = await workflow.execute_activity(
-                "reserve_inventory",
-                args=[order.order_id, order.product_name],
-                start_to_close_timeout=timedelta(seconds=30),
-                retry_policy=RetryPolicy(maximum_attempts=3, initial_interval=timedelta(seconds=2)),
-            )
-            reservation_id = result["reservation_id"]
-            self._record_compensation("inventory_reserved", reservation_id)
-
+            await self._reserve_inventory()
         except Exception as e:
-            workflow.logger.error(f"Inventory reservation failed: {e}")
-            await self._compensate()
-            return {"status": "refunded", "order_id": order.order_id, "reason": str(e)}
+            workflow.logger.error("Inventory reservation failed: %s", e)
+            return await self._refund(str(e))
 
-        # =====================================================================
         # PHASE 3: PENDING UNTIL RELEASE DATE + 1 WEEK
-        # =====================================================================
-        self._set_state(OrderState.AWAITING_RELEASE)
+        refund_reason = await self._await_release_with_timeout()
+        if refund_reason:
+            return await self._refund(refund_reason)
+
+        # PHASE 4: TRIGGER DELIVERY WORKFLOW
+        await self._process_fulfillment()
+        await self._await_item_picked()
+
+        # PHASE 5: DELIVERY
+        await self._await_delivery_confirmation()
+
+        # ORDER COMPLETED
+        workflow.logger.info("State: %s -> %s", self.state.label, OrderState.DELIVERED.label)
+        self.state = OrderState.DELIVERED
+        await self._notify("Order Completed!", f"Your {order.product_name} has been delivered!")
+
+        return {"status": "completed", "order_id": order.order_id}
+
+    # =========================================================================
+    # PHASES
+    # =========================================================================
+
+    async def _process_payment(self):
+        """Charge the customer and confirm the pre-order"""
+        order = self.order
+        workflow.logger.info("State: %s -> %s", self.state.label, OrderState.PAYMENT_PROCESSING.label)
+        self.state = OrderState.PAYMENT_PROCESSING
+
+        result = await self._act(
+            "charge_payment", [order.payment_method_id, order.amount, order.order_id], retry=_PAYMENT_RETRY
+        )
+        charge_id = result["charge_id"]
+        self._record_compensation("payment_charged", charge_id, "refund_payment")
+
+        confirmed_message = f"Payment of ${order.amount} received for {order.product_name}."
+        if workflow.patched("detached-confirmation"):
+            self._notify_detached("Pre-Order Confirmed!", confirmed_message)
+        else:
+            await self._notify("Pre-Order Confirmed!", confirmed_message)
+
+    async def _reserve_inventory(self):
+        """Reserve stock for the order"""
+        order = self.order
+        result = await self._act("reserve_inventory", [order.order_id, order.product_name], retry=_INVENTORY_RETRY)
+        reservation_id = result["reservation_id"]
+        self._record_compensation("inventory_reserved", reservation_id, "release_inventory")
+
+    async def _await_release_with_timeout(self) -> Optional[str]:
+        """Wait for fulfillment until release date + 1 week; returns a refund reason if the order can't proceed"""
+        workflow.logger.info("State: %s -> %s", self.state.label, OrderState.AWAITING_RELEASE.label)
+        self.state = OrderState.AWAITING_RELEASE
 
         # Deadline is release date + 1 week buffer
-        self.deadline = order.release_date + timedelta(weeks=1)
+        self.deadline = datetime.fromisoformat(self.order.release_date) + _RELEASE_GRACE_PERIOD
 
         # Use workflow.now instead to ensure deterministic
-        wait_duration = self.deadline - workflow.now()
+        now = workflow.now()
+        if self.deadline <= now:
+            return "Release date + 1 week has passed"
 
-        if wait_duration.total_seconds() <= 0:
-            await self._compensate()
-            return {"status": "refunded", "order_id": order.order_id, "reason": "Release date + 1 week has passed"}
+        wait_duration = self.deadline - now
 
-        workflow.logger.info(f"Waiting until {self.deadline} (release date + 1 week)...")
+        workflow.logger.info("Waiting until %s (release date + 1 week)...", self.deadline)
 
         # Wait for fulfillment signal OR cancel signal OR timeout
         timed_out = False
         try:
             await workflow.wait_condition(
-                lambda: self.start_fulfillment_requested or self.cancel_requested,
+                lambda: bool(self._flags & (_F_START | _F_CANCEL)),
                 timeout=wait_duration,
             )
-        except:
+        except asyncio.TimeoutError:
             timed_out = True
 
-        if self.cancel_requested:
-            await self._compensate()
-            return {"status": "refunded", "order_id": order.order_id, "reason": "Order cancelled by customer"}
+        if self._flags & _F_CANCEL:
+            return "Order cancelled by customer"
 
         if timed_out:
-            await self._compensate()
-            return {"status": "refunded", "order_id": order.order_id, "reason": "Fulfillment not initiated by deadline"}
+            return "Fulfillment not initiated by deadline"
 
-        # =====================================================================
-        # PHASE 4: TRIGGER DELIVERY WORKFLOW
-        # =====================================================================
-        self._set_state(OrderState.FULFILLMENT_IN_PROGRESS)
+        return None
+
+    async def _process_fulfillment(self):
+        """Create the fulfillment order and hand it to the delivery partner"""
+        order = self.order
+        workflow.logger.info("State: %s -> %s", self.state.label, OrderState.FULFILLMENT_IN_PROGRESS.label)
+        self.state = OrderState.FULFILLMENT_IN_PROGRESS
 
         # Start fulfillment process
-        result = await workflow.execute_activity(
-            "create_fulfillment",
-            args=[order.order_id],
-            start_to_close_timeout=timedelta(seconds=30),
-        )
+        result = await self._act("create_fulfillment", [order.order_id])
         fulfillment_id = result["fulfillment_id"]
-        self._record_compensation("fulfillment_created", fulfillment_id)
-
-        # Initiate the pick up process
-        await workflow.execute_activity(
-            "request_pickup",
-            args=[fulfillment_id],
-            start_to_close_timeout=timedelta(seconds=30),
-        )
-
-        await self._notify(
-            "Order Being Prepared",
-            f"Your {order.product_name} is ready for pickup by delivery service."
-        )
-
-        # Wait for item_picked signal (with reminder notifications)
-        reminder_interval = timedelta(seconds=20)
+        self._record_compensation("fulfillment_created", fulfillment_id, "cancel_fulfillment")
+
+        # Initiate the pick up process and notify the customer concurrently
+        prepared_message = f"Your {order.product_name} is ready for pickup by delivery service."
+        if workflow.patched("concurrent-pickup-notify"):
+            await asyncio.gather(
+                self._act("request_pickup", [fulfillment_id]),
+                self._notify("Order Being Prepared", prepared_message),
+            )
+        else:
+            await self._act("request_pickup", [fulfillment_id])
+            await self._notify("Order Being Prepared", prepared_message)
+
+    async def _await_item_picked(self):
+        """Wait for item_picked signal (with reminder notifications)"""
+        if workflow.patched("pickup-reminder-task"):
+            reminder_task = asyncio.create_task(self._send_pickup_reminders())
+            await workflow.wait_condition(lambda: bool(self._flags & _F_PICKED))
+            reminder_task.cancel()
+            return
+
+        # Histories started before the reminder task: one timed wait per reminder
         reminder_count = 0
-
-        # Continue send reminder every 20 seconds until pick up signal
-        while not self.item_picked_confirmed:
+        waiting_message = f"Order {self.order.order_id} is waiting to be picked up!"
+        while not self._flags & _F_PICKED:
             try:
-                await workflow.wait_condition(lambda: self.item_picked_confirmed, timeout=reminder_interval)
-            except:
+                await workflow.wait_condition(lambda: bool(self._flags & _F_PICKED), timeout=_REMINDER_INTERVAL)
+            except asyncio.TimeoutError:
                 reminder_count += 1
-                await workflow.execute_activity(
+                await self._act(
                     "send_notification",
-                    args=["partner@example.com", f"Pick Up Reminder #{reminder_count}",
-                          f"Order {order.order_id} is waiting to be picked up!"],
-                    start_to_close_timeout=timedelta(seconds=10),
+                    [_PARTNER_EMAIL, f"{_SUBJECT_PICKUP_REMINDER} #{reminder_count}", waiting_message],
+                    timeout=_NOTIFY_TIMEOUT,
                 )
 
-        # =====================================================================
-        # PHASE 5: DELIVERY
-        # =====================================================================
-        self._set_state(OrderState.AWAITING_DELIVERY)
-
-        await self._notify(
-            "Item Picked Up",
-            f"Your {order.product_name} has been picked up and is on its way!"
-        )
-
-        await workflow.wait_condition(lambda: self.delivery_confirmed)
-
-        # =====================================================================
-        # ORDER COMPLETED
-        # =====================================================================
-        self._set_state(OrderState.DELIVERED)
-        await self._notify("Order Completed!", f"Your {order.product_name} has been delivered!")
+    async def _send_pickup_reminders(self):
+        """Queue a reminder every 20 seconds, flushing the queue whenever the previous send has finished"""
+        reminder_count = 0
+        pending_reminders: List[Tuple[str, str]] = []
+        in_flight: Optional[asyncio.Task] = None
+        waiting_message = f"Order {self.order.order_id} is waiting to be picked up!"
 
-        return {"status": "completed", "order_id": order.order_id}
+        try:
+            while True:
+                await workflow.sleep(_REMINDER_INTERVAL)
+                reminder_count += 1
+                pending_reminders.append((f"{_SUBJECT_PICKUP_REMINDER} #{reminder_count}", waiting_message))
+                if in_flight is None or in_flight.done():
+                    in_flight = asyncio.create_task(
+                        self._act("send_notification_batch", [_PARTNER_EMAIL, pending_reminders], timeout=_NOTIFY_TIMEOUT)
+                    )
+                    pending_reminders = []
+        finally:
+            # Only the last send can still be running; run awaits it before completing
+            if in_flight is not None:
+                self._pending_notifications.append(in_flight)
+
+    async def _await_delivery_confirmation(self):
+        """Notify the customer the item is on its way and wait for delivery"""
+        workflow.logger.info("State: %s -> %s", self.state.label, OrderState.AWAITING_DELIVERY.label)
+        self.state = OrderState.AWAITING_DELIVERY
+
+        # Notify while already listening for delivery confirmation
+        picked_message = f"Your {self.order.product_name} has been picked up and is on its way!"
+        if workflow.patched("detached-pickup-notice"):
+            self._notify_detached("Item Picked Up", picked_message)
+        else:
+            await self._notify("Item Picked Up", picked_message)
+
+        await workflow.wait_condition(lambda: bool(self._flags & _F_DELIVERED))
 
     # =========================================================================
     # SIGNALS
@@ -190,25 +273,25 @@ class PreOrderWorkflow:
     def start_fulfillment(self):
         """Signal to begin fulfillment process"""
         workflow.logger.info("Signal: start_fulfillment")
-        self.start_fulfillment_requested = True
+        self._flags |= _F_START
 
     @workflow.signal
     def cancel_order(self):
         """Signal to cancel order (triggers saga)"""
         workflow.logger.info("Signal: cancel_order")
-        self.cancel_requested = True
+        self._flags |= _F_CANCEL
 
     @workflow.signal
     def item_picked(self):
         """Signal: external delivery system picked up the item"""
         workflow.logger.info("Signal: item_picked")
-        self.item_picked_confirmed = True
+        self._flags |= _F_PICKED
 
     @workflow.signal
     def confirm_delivery(self):
         """Signal to confirm delivery complete"""
         workflow.logger.info("Signal: confirm_delivery")
-        self.delivery_confirmed = True
+        self._flags |= _F_DELIVERED
 
     # =========================================================================
     # QUERIES
@@ -218,12 +301,16 @@ class PreOrderWorkflow:
     def get_status(self) -> dict:
         return {
             "order_id": self.order.order_id if self.order else None,
-            "state": self.state.value,
+            "state": self.state.label,
         }
 
     @workflow.query
-    def get_compensation_log(self) -> List[dict]:
-        return [{"action": r.action, "resource_id": r.resource_id} for r in self.compensation_log]
+    def get_compensation_log(self) -> List[str]:
+        n = len(self._comp_actions)
+        if self._comp_log_cache is None or self._comp_log_cache[0] != n:
+            packed = [pack_compensation(a, r) for a, r in zip(self._comp_actions, self._comp_resource_ids)]
+            self._comp_log_cache = (n, packed)
+        return self._comp_log_cache[1]
 
     @workflow.query
     def get_deadline_info(self) -> dict:
@@ -236,51 +323,53 @@ class PreOrderWorkflow:
     # HELPERS
     # =========================================================================
 
-    # State management
-    def _set_state(self, new_state: OrderState):
-        workflow.logger.info(f"State: {self.state.value} -> {new_state.value}")
-        self.state = new_state
-
-    # Record compensation actions in order
-    def _record_compensation(self, action: str, resource_id: str):
-        self.compensation_log.append(CompensationRecord(action=action, resource_id=resource_id))
+    # Record compensation actions in order, with the activity that undoes each
+    def _record_compensation(self, action: str, resource_id: str, compensating_activity: str):
+        self._comp_actions.append(action)
+        self._comp_resource_ids.append(resource_id)
+        self._comp_activities.append(compensating_activity)
+
+    # Run an activity with the shared default timeout and retry settings
+    async def _act(
+        self,
+        name: str,
+        args: list,
+        timeout: timedelta = _DEFAULT_ACTIVITY_TIMEOUT,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        return await workflow.execute_activity(
+            name,
+            args=args,
+            start_to_close_timeout=timeout,
+            retry_policy=retry,
+        )
 
     # Send notification (helper)
     async def _notify(self, subject: str, message: str):
-        await workflow.execute_activity(
-            "send_notification",
-            args=[self.order.customer_email, subject, message],
-            start_to_close_timeout=timedelta(seconds=10),
-        )
+        await self._act("send_notification", [self.order.customer_email, subject, message], timeout=_NOTIFY_TIMEOUT)
+
+    # Send notification without waiting for it (see run)
+    def _notify_detached(self, subject: str, message: str):
+        self._pending_notifications.append(asyncio.create_task(self._notify(subject, message)))
+
+    # Compensate and build the refunded result
+    async def _refund(self, reason: str) -> dict:
+        await self._compensate()
+        return {"status": "refunded", "order_id": self.order.order_id, "reason": reason}
 
     # Saga compensation (reverse order)
     async def _compensate(self):
         """Execute compensation in REVERSE order (Saga pattern)"""
-        self._set_state(OrderState.REFUNDED)
-        workflow.logger.info(f"====== SAGA COMPENSATION ({len(self.compensation_log)} actions) ======")
-
-        # Map actions to their compensation activities
-        compensation_map = {
-            "payment_charged": "refund_payment",
-            "inventory_reserved": "release_inventory",
-            "fulfillment_created": "cancel_fulfillment",
-        }
+        workflow.logger.info("State: %s -> %s", self.state.label, OrderState.REFUNDED.label)
+        self.state = OrderState.REFUNDED
+        total = len(self._comp_actions)
+        workflow.logger.info("SAGA: compensating %d actions in reverse", total)
 
         # Execute compensation in reverse order
-        for record in reversed(self.compensation_log):
-            activity_name = compensation_map.get(record.action)
-            if activity_name:
-                workflow.logger.info(f"   {record.action} -> {activity_name}({record.resource_id})")
-                await workflow.execute_activity(
-                    activity_name,
-                    args=[record.resource_id],
-                    start_to_close_timeout=timedelta(seconds=30),
-                    retry_policy=RetryPolicy(
-                        maximum_attempts=100,
-                        initial_interval=timedelta(seconds=1),
-                        maximum_interval=timedelta(seconds=30),
-                    ),
-                )
+        steps = zip(reversed(self._comp_actions), reversed(self._comp_resource_ids), reversed(self._comp_activities))
+        for i, (action, resource_id, activity_name) in enumerate(steps, start=1):
+            workflow.logger.info("   [%d/%d] %s -> %s(%s)", i, total, action, activity_name, resource_id)
+            await self._act(activity_name, [resource_id], retry=_COMPENSATION_RETRY)
 
         await self._notify(
             "Order Refunded",